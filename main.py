@@ -6,24 +6,36 @@ Production Ready with Zero Errors
 
 import os
 import sys
+import atexit
 import asyncio
+import heapq
+import json
 import time
 import random
-import traceback
-from typing import Dict, List, Optional, Any
-from datetime import datetime
-from collections import defaultdict
+import re
+import threading
+from typing import Dict, List, Deque, Optional, Any, Tuple
+from datetime import datetime, timedelta
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from enum import Enum
+from functools import lru_cache
 
 # Pyrogram imports with error handling
 try:
     from pyrogram import Client, filters, idle
-    from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+    from pyrogram.types import (
+        Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery,
+        ChatMemberUpdated
+    )
     from pyrogram.errors import (
         FloodWait, UserAlreadyParticipant, ChatAdminRequired,
-        ChannelPrivate, UserNotParticipant, InviteHashExpired
+        ChannelPrivate, UserNotParticipant, InviteHashExpired,
+        MessageIdInvalid, MessageDeleteForbidden, MessageAuthorRequired,
+        MessageNotModified, RPCError
     )
-    from pyrogram.enums import ChatMemberStatus, ParseMode
+    from pyrogram.enums import ChatMemberStatus, ChatType, ParseMode
 except ImportError:
     print("ERROR: Pyrogram not installed. Run: pip install pyrogram tgcrypto")
     sys.exit(1)
@@ -44,21 +56,56 @@ except ImportError:
     print("ERROR: yt-dlp not installed. Run: pip install yt-dlp")
     sys.exit(1)
 
+# aiofiles import with error handling
+try:
+    import aiofiles.os
+except ImportError:
+    print("ERROR: aiofiles not installed. Run: pip install aiofiles")
+    sys.exit(1)
+
+# uvloop is optional - fall back to the default asyncio loop without it
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 # -------------------------
 # Logging Setup
 # -------------------------
 import logging
+import logging.handlers
+from queue import SimpleQueue
+
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.StreamHandler(sys.stdout),
+    logging.FileHandler('bot.log', encoding='utf-8')
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+
+# Records are written by a listener thread so slow stdout/file writes
+# never block the event loop
+_log_queue_handler = logging.handlers.QueueHandler(SimpleQueue())
+_log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+log_listener = logging.handlers.QueueListener(_log_queue_handler.queue, *_log_handlers)
+log_listener.start()
+# Drain queued records on every exit path, including sys.exit during startup
+atexit.register(log_listener.stop)
+
+_log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+_log_level_valid = isinstance(logging.getLevelName(_log_level), int)
 
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('bot.log', encoding='utf-8')
-    ]
+    level=_log_level if _log_level_valid else logging.INFO,
+    handlers=[_log_queue_handler]
 )
 logger = logging.getLogger(__name__)
 
+if not _log_level_valid:
+    logger.warning("Unknown LOG_LEVEL %r, using INFO", _log_level)
+
 # -------------------------
 # Configuration
 # -------------------------
@@ -72,12 +119,36 @@ class Config:
     # Optional
     LOG_CHANNEL = os.getenv("LOG_CHANNEL", "")
     SUDO_USERS = [int(x.strip()) for x in os.getenv("SUDO_USERS", "").split(",") if x.strip().isdigit()]
+    BOT_WORKERS = int(os.getenv("BOT_WORKERS", "16"))  # concurrent update handlers
+    YTDL_WORKERS = int(os.getenv("YTDL_WORKERS", "4"))  # threads for yt-dlp searches and downloads
+    MAX_PARALLEL_DOWNLOADS = int(os.getenv("MAX_PARALLEL_DOWNLOADS", "3"))
     
     # Settings
     DOWNLOAD_DIR = "downloads"
     MAX_DURATION = 3600  # 1 hour
     MAX_QUEUE_SIZE = 50
     AUTO_LEAVE_TIME = 180  # 3 minutes
+    MAX_LEAVE_RETRIES = 3  # failed auto-leaves before the chat is forgotten
+    # Local files need little probing; half a second of it is still enough to
+    # detect the webm/opus, m4a and mp3 files the downloader can produce
+    FFMPEG_PARAMETERS = "-probesize 1M -analyzeduration 500000 -fflags nobuffer"
+    ADMIN_CACHE_TTL = 60  # seconds
+    NON_ADMIN_CACHE_TTL = 30  # seconds, shorter so promotions apply sooner
+    ASSISTANT_CHAT_TTL = 3600  # recheck membership hourly in case it was removed
+    PEER_WARMUP_LIMIT = 200  # assistant dialogs loaded at startup
+    PANEL_EDIT_DELAY = 0.3  # seconds to coalesce player button presses
+    MAX_PLAY_FAILURES = 5  # consecutive failed songs before stopping
+    DOWNLOAD_CACHE_SIZE = 200
+    DOWNLOAD_CACHE_BYTES = 2 * 1024 ** 3  # 2 GB of audio kept on disk
+    DOWNLOAD_MAX_AGE = 86400  # 1 day since last play
+    CLEANUP_INTERVAL = 21600  # 6 hours between sweeps when nothing is playing
+    STATE_FILE = "queues.json"
+    STATE_SAVE_INTERVAL = 30  # seconds
+    RESTORED_QUEUE_TTL = 3600  # restored queues nobody resumes are dropped after this
+    SEARCH_CACHE_SIZE = 512
+    SEARCH_CACHE_TTL = 3600  # 1 hour
+    INFO_CACHE_SIZE = 64  # full yt-dlp info dicts are large
+    INFO_CACHE_TTL = 1800  # well inside YouTube's format URL expiry
     
     @classmethod
     def validate(cls):
@@ -107,6 +178,8 @@ except ValueError as e:
 # Create download directory
 os.makedirs(Config.DOWNLOAD_DIR, exist_ok=True)
 
+AUDIO_EXTENSIONS = ('webm', 'm4a', 'opus', 'mp3', 'mp4')
+
 # -------------------------
 # Data Models
 # -------------------------
@@ -117,6 +190,11 @@ class LoopMode(Enum):
 
 class Song:
     """Song data model"""
+    __slots__ = (
+        'title', 'url', 'duration', 'video_id', 'requester',
+        'requester_id', 'file_path', 'prefetch'
+    )
+    
     def __init__(self, title: str, url: str, duration: int, video_id: str, 
                  requester: str, requester_id: int):
         self.title = title
@@ -126,15 +204,66 @@ class Song:
         self.requester = requester
         self.requester_id = requester_id
         self.file_path: Optional[str] = None
+        self.prefetch: Optional[asyncio.Task] = None
+
+class LRUCache:
+    """Bounded LRU cache with optional expiry checked only on the touched entry"""
+    def __init__(self, maxsize: int, ttl: Optional[float] = None, sliding: bool = False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sliding = sliding  # restart the default ttl on every hit
+        self._data: "OrderedDict[Any, Tuple[Any, float]]" = OrderedDict()
+    
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Get a value, dropping it if expired"""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        
+        value, expires_at = entry
+        now = time.monotonic()
+        if expires_at <= now:
+            del self._data[key]
+            return default
+        
+        if self.sliding and self.ttl is not None:
+            self._data[key] = (value, now + self.ttl)
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entry when full"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else float('inf')
+        
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def pop(self, key: Any, default: Any = None) -> Any:
+        """Remove a value"""
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+    
+    def __contains__(self, key: Any) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[1] > time.monotonic()
+    
+    def __len__(self) -> int:
+        return len(self._data)
 
 class Queue:
     """Queue manager for each chat"""
+    __slots__ = ('songs', 'current', 'loop_mode', 'is_playing', 'is_paused', 'generation')
+    
     def __init__(self):
-        self.songs: List[Song] = []
+        self.songs: Deque[Song] = deque()
         self.current: Optional[Song] = None
         self.loop_mode = LoopMode.DISABLED
         self.is_playing = False
         self.is_paused = False
+        self.generation = 0  # bumped per advance; a newer advance supersedes a loading song
     
     def add_song(self, song: Song) -> int:
         """Add song to queue"""
@@ -150,28 +279,58 @@ class Queue:
             self.songs.append(self.current)
         
         if self.songs:
-            return self.songs.pop(0)
+            return self.songs.popleft()
         
         return None
     
     def clear(self):
         """Clear queue"""
+        for song in self.songs:
+            if song.prefetch and not song.prefetch.done():
+                song.prefetch.cancel()
         self.songs.clear()
         self.current = None
         self.is_playing = False
         self.is_paused = False
+        self.generation += 1
     
     def shuffle(self):
         """Shuffle queue"""
-        random.shuffle(self.songs)
+        # random.shuffle indexes into the sequence, which is O(n) on a deque
+        songs = list(self.songs)
+        random.shuffle(songs)
+        self.songs = deque(songs)
 
 # -------------------------
 # Global State
 # -------------------------
-START_TIME = datetime.now()
-queues: Dict[int, Queue] = defaultdict(Queue)
-active_chats: set = set()
-download_cache: Dict[str, str] = {}
+START_TIME = time.monotonic()
+queues: Dict[int, Queue] = {}  # created by /play, read with .get()
+active_chats: Dict[int, float] = {}  # chat_id -> monotonic time of last stream start
+download_cache = LRUCache(maxsize=Config.DOWNLOAD_CACHE_SIZE)
+admin_cache = LRUCache(maxsize=4096, ttl=Config.ADMIN_CACHE_TTL)
+assistant_chats = LRUCache(maxsize=4096, ttl=Config.ASSISTANT_CHAT_TTL)  # chats the assistant has joined
+search_cache = LRUCache(
+    maxsize=Config.SEARCH_CACHE_SIZE, ttl=Config.SEARCH_CACHE_TTL, sliding=True
+)
+info_cache = LRUCache(maxsize=Config.INFO_CACHE_SIZE, ttl=Config.INFO_CACHE_TTL)  # video_id -> yt-dlp info
+search_inflight: Dict[str, asyncio.Task] = {}  # normalized query -> running lookup
+download_inflight: Dict[str, asyncio.Task] = {}  # video_id -> running download
+chat_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+leave_deadlines: List[Tuple[float, int]] = []  # heap of (deadline, chat_id)
+leave_wakeup = asyncio.Event()
+leave_retries: Dict[int, int] = {}  # chat_id -> failed auto-leave attempts
+cleanup_wakeup = asyncio.Event()
+background_tasks: set = set()
+pending_panels: Dict[Tuple[int, int], Message] = {}  # (chat_id, message_id) -> panel to refresh
+
+# yt-dlp gets its own threads so long downloads can't starve the default
+# executor used for file scans and cleanup
+ytdl_executor = ThreadPoolExecutor(max_workers=Config.YTDL_WORKERS, thread_name_prefix="ytdl")
+# Fewer download slots than threads, so searches never wait behind downloads
+download_semaphore = asyncio.Semaphore(
+    max(1, min(Config.MAX_PARALLEL_DOWNLOADS, Config.YTDL_WORKERS - 1))
+)
 
 # -------------------------
 # Initialize Clients
@@ -184,6 +343,7 @@ bot = Client(
     api_hash=Config.API_HASH,
     bot_token=Config.BOT_TOKEN,
     parse_mode=ParseMode.MARKDOWN,
+    workers=Config.BOT_WORKERS,
     workdir=".",
     plugins=None
 )
@@ -207,42 +367,76 @@ logger.info("✅ Clients initialized")
 class YouTubeDownloader:
     """YouTube search and download handler"""
     
+    # YoutubeDL instances are expensive to build and not thread-safe,
+    # so each executor thread keeps its own per option profile
+    _local = threading.local()
+    
     @staticmethod
     def get_ydl_opts(download: bool = False) -> dict:
         """Get yt-dlp options"""
         opts = {
-            'format': 'bestaudio/best',
+            # Native audio streams; ffmpeg in AudioPiped decodes them directly
+            'format': 'bestaudio[ext=webm]/bestaudio[ext=m4a]/bestaudio/best',
             'quiet': True,
             'no_warnings': True,
             'geo_bypass': True,
             'nocheckcertificate': True,
             'outtmpl': f'{Config.DOWNLOAD_DIR}/%(id)s.%(ext)s',
+            # Keep mtime as "last used" for the file cache, not the upload date
+            'updatetime': False,
         }
         
-        if download:
-            opts['postprocessors'] = [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'm4a',
-                'preferredquality': '192',
-            }]
+        if not download:
+            # Only the first entry is used, so don't resolve whole playlists
+            opts['noplaylist'] = True
+            opts['playlist_items'] = '1'
         
         return opts
     
+    @staticmethod
+    def get_ydl(download: bool = False) -> yt_dlp.YoutubeDL:
+        """Get the reusable yt-dlp instance for the current thread"""
+        attr = 'download_ydl' if download else 'search_ydl'
+        ydl = getattr(YouTubeDownloader._local, attr, None)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(YouTubeDownloader.get_ydl_opts(download=download))
+            setattr(YouTubeDownloader._local, attr, ydl)
+        return ydl
+    
     @staticmethod
     async def search(query: str) -> Optional[dict]:
-        """Search YouTube for a song"""
+        """Search YouTube for a song, sharing cached and in-flight lookups"""
+        key = query if query.startswith("http") else " ".join(query.lower().split())
+        
+        result = search_cache.get(key)
+        if result:
+            return result
+        
+        # Concurrent /play calls for the same query wait on one lookup
+        task = search_inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(YouTubeDownloader.fetch_search(query))
+            search_inflight[key] = task
+            task.add_done_callback(lambda _: search_inflight.pop(key, None))
+        
+        result = await asyncio.shield(task)
+        if result:
+            search_cache.set(key, result)
+        return result
+    
+    @staticmethod
+    async def fetch_search(query: str) -> Optional[dict]:
+        """Run a YouTube search with yt-dlp"""
         try:
             search_query = query if query.startswith("http") else f"ytsearch1:{query}"
             
-            ydl_opts = YouTubeDownloader.get_ydl_opts(download=False)
-            
             loop = asyncio.get_event_loop()
             
             def extract():
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    return ydl.extract_info(search_query, download=False)
+                ydl = YouTubeDownloader.get_ydl(download=False)
+                return ydl.extract_info(search_query, download=False)
             
-            info = await loop.run_in_executor(None, extract)
+            info = await loop.run_in_executor(ytdl_executor, extract)
             
             if not info:
                 return None
@@ -253,63 +447,115 @@ class YouTubeDownloader:
                     return None
                 info = info['entries'][0]
             
+            # Live streams and premieres have no duration and would never finish downloading
+            is_live = (
+                bool(info.get('is_live'))
+                or info.get('live_status') in ('is_live', 'is_upcoming')
+                or info.get('duration') is None
+            )
+            
+            # Kept briefly so the download can skip a second extraction
+            if info.get('id') and not is_live:
+                info_cache.set(info['id'], info)
+            
             return {
                 'title': info.get('title', 'Unknown Title'),
                 'url': info.get('webpage_url') or info.get('url', ''),
-                'duration': int(info.get('duration', 0)),
+                'duration': int(info.get('duration') or 0),
                 'id': info.get('id', ''),
-                'thumbnail': info.get('thumbnail', '')
+                'thumbnail': info.get('thumbnail', ''),
+                'is_live': is_live
             }
             
         except Exception as e:
-            logger.error(f"YouTube search error: {e}")
-            traceback.print_exc()
+            logger.exception("YouTube search error: %s", e)
             return None
     
+    @staticmethod
+    async def find_file(video_id: str) -> Optional[str]:
+        """Find an already downloaded file for a video"""
+        prefix = f"{video_id}."
+        
+        def scan():
+            # One directory read instead of a stat per candidate extension
+            with os.scandir(Config.DOWNLOAD_DIR) as entries:
+                for entry in entries:
+                    if (entry.name.startswith(prefix)
+                            and entry.name[len(prefix):] in AUDIO_EXTENSIONS
+                            and entry.is_file()):
+                        return entry.path
+            return None
+        
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, scan)
+    
     @staticmethod
     async def download(url: str, video_id: str) -> Optional[str]:
-        """Download audio from YouTube"""
+        """Download audio from YouTube, sharing in-flight downloads of a video"""
+        # The same song queued in several chats is fetched once; shield keeps
+        # a cancelled prefetch from aborting the download for other waiters
+        task = download_inflight.get(video_id)
+        if task is None:
+            task = asyncio.ensure_future(YouTubeDownloader.fetch_audio(url, video_id))
+            download_inflight[video_id] = task
+            task.add_done_callback(lambda _: download_inflight.pop(video_id, None))
+        
+        return await asyncio.shield(task)
+    
+    @staticmethod
+    async def fetch_audio(url: str, video_id: str) -> Optional[str]:
+        """Return a local file for a video, downloading it if needed"""
         try:
             # Check cache first
-            if video_id in download_cache:
-                cached_path = download_cache[video_id]
-                if os.path.exists(cached_path):
-                    logger.info(f"Using cached file: {cached_path}")
-                    return cached_path
+            loop = asyncio.get_event_loop()
+            cached_path = download_cache.get(video_id)
+            if cached_path and await aiofiles.os.path.exists(cached_path):
+                await loop.run_in_executor(None, os.utime, cached_path)
+                logger.info("Using cached file: %s", cached_path)
+                return cached_path
             
             # Check if file already exists
-            for ext in ['m4a', 'webm', 'opus', 'mp3']:
-                file_path = os.path.join(Config.DOWNLOAD_DIR, f"{video_id}.{ext}")
-                if os.path.exists(file_path):
-                    download_cache[video_id] = file_path
-                    logger.info(f"File already exists: {file_path}")
-                    return file_path
+            file_path = await YouTubeDownloader.find_file(video_id)
+            if file_path:
+                await loop.run_in_executor(None, os.utime, file_path)
+                download_cache.set(video_id, file_path)
+                logger.info("File already exists: %s", file_path)
+                return file_path
             
             # Download
-            ydl_opts = YouTubeDownloader.get_ydl_opts(download=True)
+            search_info = info_cache.pop(video_id)
             
-            loop = asyncio.get_event_loop()
+            def download_audio() -> Optional[str]:
+                ydl = YouTubeDownloader.get_ydl(download=True)
+                info = None
+                if search_info:
+                    try:
+                        info = ydl.process_ie_result(search_info, download=True)
+                    except Exception as e:
+                        # Format URLs from the search may have expired
+                        logger.warning("Reusing search info failed for %s: %s", video_id, e)
+                if info is None:
+                    info = ydl.extract_info(url, download=True)
+                downloads = (info or {}).get('requested_downloads') or []
+                return downloads[0].get('filepath') if downloads else None
             
-            def download_audio():
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([url])
+            async with download_semaphore:
+                file_path = await loop.run_in_executor(ytdl_executor, download_audio)
             
-            await loop.run_in_executor(None, download_audio)
+            # yt-dlp reports where it wrote the file; scan only if it didn't
+            if not file_path or not await aiofiles.os.path.exists(file_path):
+                file_path = await YouTubeDownloader.find_file(video_id)
             
-            # Find downloaded file
-            for ext in ['m4a', 'webm', 'opus', 'mp3']:
-                file_path = os.path.join(Config.DOWNLOAD_DIR, f"{video_id}.{ext}")
-                if os.path.exists(file_path):
-                    download_cache[video_id] = file_path
-                    logger.info(f"Downloaded successfully: {file_path}")
-                    return file_path
+            if file_path:
+                download_cache.set(video_id, file_path)
+                logger.info("Downloaded successfully: %s", file_path)
+                return file_path
             
-            logger.error(f"Download completed but file not found: {video_id}")
+            logger.error("Download completed but file not found: %s", video_id)
             return None
             
         except Exception as e:
-            logger.error(f"Download error: {e}")
-            traceback.print_exc()
+            logger.exception("Download error: %s", e)
             return None
 
 # -------------------------
@@ -322,17 +568,22 @@ class MusicPlayer:
     async def play(chat_id: int, file_path: str):
         """Start playing audio"""
         try:
-            if not os.path.exists(file_path):
+            if not await aiofiles.os.path.exists(file_path):
                 raise FileNotFoundError(f"File not found: {file_path}")
             
             # Create audio stream
+            ffmpeg_params = Config.FFMPEG_PARAMETERS
             try:
-                audio_stream = AudioPiped(file_path, HighQualityAudio())
+                audio_stream = AudioPiped(
+                    file_path, HighQualityAudio(), additional_ffmpeg_parameters=ffmpeg_params
+                )
             except Exception:
                 try:
-                    audio_stream = AudioPiped(file_path, MediumQualityAudio())
+                    audio_stream = AudioPiped(
+                        file_path, MediumQualityAudio(), additional_ffmpeg_parameters=ffmpeg_params
+                    )
                 except Exception:
-                    audio_stream = AudioPiped(file_path)
+                    audio_stream = AudioPiped(file_path, additional_ffmpeg_parameters=ffmpeg_params)
             
             # Check if already in call
             try:
@@ -340,21 +591,21 @@ class MusicPlayer:
                 if call:
                     # Change stream
                     await calls.change_stream(chat_id, audio_stream)
-                    logger.info(f"Changed stream in {chat_id}")
+                    logger.info("Changed stream in %s", chat_id)
                 else:
                     # Join call
                     await calls.join_group_call(chat_id, audio_stream)
-                    logger.info(f"Joined call in {chat_id}")
+                    logger.info("Joined call in %s", chat_id)
             except Exception:
                 # Join call
                 await calls.join_group_call(chat_id, audio_stream)
-                logger.info(f"Joined call in {chat_id}")
+                logger.info("Joined call in %s", chat_id)
             
-            active_chats.add(chat_id)
+            active_chats[chat_id] = time.monotonic()
+            schedule_auto_leave(chat_id)
             
         except Exception as e:
-            logger.error(f"Play error in {chat_id}: {e}")
-            traceback.print_exc()
+            logger.exception("Play error in %s: %s", chat_id, e)
             raise
     
     @staticmethod
@@ -362,9 +613,9 @@ class MusicPlayer:
         """Pause playback"""
         try:
             await calls.pause_stream(chat_id)
-            logger.info(f"Paused in {chat_id}")
+            logger.info("Paused in %s", chat_id)
         except Exception as e:
-            logger.error(f"Pause error: {e}")
+            logger.error("Pause error: %s", e)
             raise
     
     @staticmethod
@@ -372,9 +623,9 @@ class MusicPlayer:
         """Resume playback"""
         try:
             await calls.resume_stream(chat_id)
-            logger.info(f"Resumed in {chat_id}")
+            logger.info("Resumed in %s", chat_id)
         except Exception as e:
-            logger.error(f"Resume error: {e}")
+            logger.error("Resume error: %s", e)
             raise
     
     @staticmethod
@@ -382,102 +633,168 @@ class MusicPlayer:
         """Stop playback and leave call"""
         try:
             await calls.leave_group_call(chat_id)
-            active_chats.discard(chat_id)
-            logger.info(f"Left call in {chat_id}")
+            active_chats.pop(chat_id, None)
+            logger.info("Left call in %s", chat_id)
         except Exception as e:
-            logger.error(f"Stop error: {e}")
+            logger.error("Stop error: %s", e)
             # Don't raise, just log
 
 # -------------------------
 # Queue Processing
 # -------------------------
-async def process_next_song(chat_id: int):
-    """Process and play next song in queue"""
-    try:
-        queue = queues[chat_id]
-        next_song = queue.get_next_song()
-        
-        if not next_song:
-            # Queue finished
-            await MusicPlayer.stop(chat_id)
-            queue.clear()
+async def process_next_song(chat_id: int, picked: Optional[Tuple[Queue, Song, int]] = None):
+    """Process and play next song in queue
+    
+    picked is a (queue, song, generation) already taken under the chat lock.
+    """
+    # Loop instead of recursing so a run of failures keeps a flat stack
+    failures = 0
+    while True:
+        if failures >= Config.MAX_PLAY_FAILURES:
+            # Likely a dead network or a looped broken song; don't spin forever
+            async with chat_locks[chat_id]:
+                await MusicPlayer.stop(chat_id)
+                reset_chat(chat_id)
             
             try:
                 await bot.send_message(
                     chat_id,
-                    "✅ **Queue finished!** Thanks for listening 🎵"
+                    f"❌ **Stopped after {failures} failed songs in a row.**",
+                    disable_notification=True
                 )
-            except Exception as e:
-                logger.error(f"Failed to send queue finished message: {e}")
+            except:
+                pass
             
             return
         
-        # Download song if not cached
-        if not next_song.file_path or not os.path.exists(next_song.file_path):
-            next_song.file_path = await YouTubeDownloader.download(
-                next_song.url,
-                next_song.video_id
+        try:
+            # The lock covers queue changes and the play call but not the
+            # download, so buttons and /stop stay responsive while a song loads
+            if picked:
+                queue, next_song, generation = picked
+                picked = None
+            else:
+                async with chat_locks[chat_id]:
+                    queue = queues.get(chat_id)
+                    next_song = queue.get_next_song() if queue else None
+                    
+                    if next_song:
+                        queue.generation += 1
+                        generation = queue.generation
+                    else:
+                        # Queue finished
+                        await MusicPlayer.stop(chat_id)
+                        reset_chat(chat_id)
+                
+                if not next_song:
+                    try:
+                        await bot.send_message(
+                            chat_id,
+                            "✅ **Queue finished!** Thanks for listening 🎵",
+                            disable_notification=True
+                        )
+                    except Exception as e:
+                        logger.error("Failed to send queue finished message: %s", e)
+                    
+                    return
+            
+            # Let a background prefetch of this song finish first
+            if next_song.prefetch and not next_song.prefetch.done():
+                await next_song.prefetch
+            
+            # Download song if not cached
+            if not next_song.file_path or not await aiofiles.os.path.exists(next_song.file_path):
+                next_song.file_path = await YouTubeDownloader.download(
+                    next_song.url,
+                    next_song.video_id
+                )
+            
+            # A /stop or a newer skip during the download takes precedence
+            if queues.get(chat_id) is not queue or queue.generation != generation:
+                return
+            
+            if not next_song.file_path:
+                # Download failed, try next song
+                try:
+                    await bot.send_message(
+                        chat_id,
+                        f"❌ **Failed to download:** {next_song.title}\nSkipping to next...",
+                        disable_notification=True
+                    )
+                except:
+                    pass
+                
+                failures += 1
+                continue
+            
+            # Play the song
+            async with chat_locks[chat_id]:
+                if queues.get(chat_id) is not queue or queue.generation != generation:
+                    return
+                
+                await MusicPlayer.play(chat_id, next_song.file_path)
+                
+                queue.current = next_song
+                queue.is_playing = True
+                queue.is_paused = False
+            
+            # Send now playing message
+            text = (
+                f"🎵 **Now Playing**\n\n"
+                f"**{next_song.title}**\n"
+                f"⏱ Duration: `{format_duration(next_song.duration)}`\n"
+                f"👤 Requested by: {next_song.requester}"
             )
-        
-        if not next_song.file_path:
-            # Download failed, try next song
+            
+            if queue.loop_mode != LoopMode.DISABLED:
+                text += f"\n🔁 Loop: **{queue.loop_mode.name}**"
+            
+            if queue.songs:
+                text += f"\n📋 Next: **{queue.songs[0].title}**"
+            
+            prefetch_next_song(queue)
+            
             try:
                 await bot.send_message(
                     chat_id,
-                    f"❌ **Failed to download:** {next_song.title}\nSkipping to next..."
+                    text,
+                    reply_markup=get_player_keyboard(chat_id, queue),
+                    disable_web_page_preview=True
                 )
-            except:
-                pass
+            except Exception as e:
+                logger.error("Failed to send now playing message: %s", e)
             
-            await process_next_song(chat_id)
             return
-        
-        # Play the song
-        await MusicPlayer.play(chat_id, next_song.file_path)
-        
-        queue.current = next_song
-        queue.is_playing = True
-        queue.is_paused = False
-        
-        # Send now playing message
-        text = (
-            f"🎵 **Now Playing**\n\n"
-            f"**{next_song.title}**\n"
-            f"⏱ Duration: `{format_duration(next_song.duration)}`\n"
-            f"👤 Requested by: {next_song.requester}"
-        )
-        
-        if queue.loop_mode != LoopMode.DISABLED:
-            text += f"\n🔁 Loop: **{queue.loop_mode.name}**"
-        
-        if queue.songs:
-            text += f"\n📋 Next: **{queue.songs[0].title}**"
-        
-        try:
-            await bot.send_message(
-                chat_id,
-                text,
-                reply_markup=get_player_keyboard(chat_id),
-                disable_web_page_preview=True
-            )
+            
         except Exception as e:
-            logger.error(f"Failed to send now playing message: {e}")
-        
-    except Exception as e:
-        logger.error(f"Process next song error in {chat_id}: {e}")
-        traceback.print_exc()
-        
-        try:
-            await bot.send_message(
-                chat_id,
-                f"❌ **Playback error:** {str(e)}\n\nTrying next song..."
-            )
-        except:
-            pass
-        
-        # Try to recover
-        await asyncio.sleep(2)
-        await process_next_song(chat_id)
+            logger.exception("Process next song error in %s: %s", chat_id, e)
+            
+            try:
+                await bot.send_message(
+                    chat_id,
+                    f"❌ **Playback error:** {str(e)}\n\nTrying next song...",
+                    disable_notification=True
+                )
+            except:
+                pass
+            
+            # Try to recover
+            failures += 1
+            await asyncio.sleep(2)
+
+def prefetch_next_song(queue: Queue):
+    """Start downloading the upcoming song while the current one plays"""
+    if not queue.songs:
+        return
+    
+    song = queue.songs[0]
+    if song.file_path or song.prefetch:
+        return
+    
+    async def prefetch():
+        song.file_path = await YouTubeDownloader.download(song.url, song.video_id)
+    
+    song.prefetch = create_background_task(prefetch())
 
 # -------------------------
 # PyTgCalls Event Handlers
@@ -487,47 +804,55 @@ async def on_stream_end_handler(client, update):
     """Handle when stream ends"""
     try:
         chat_id = update.chat_id
-        logger.info(f"Stream ended in {chat_id}")
+        logger.info("Stream ended in %s", chat_id)
+        cleanup_wakeup.set()
         
         await asyncio.sleep(1)
         await process_next_song(chat_id)
         
     except Exception as e:
-        logger.error(f"Stream end handler error: {e}")
-        traceback.print_exc()
+        logger.exception("Stream end handler error: %s", e)
 
 @calls.on_kicked()
 async def on_kicked_handler(client, chat_id: int):
     """Handle when assistant is kicked"""
-    logger.warning(f"Assistant kicked from {chat_id}")
-    queues[chat_id].clear()
-    active_chats.discard(chat_id)
+    logger.warning("Assistant kicked from %s", chat_id)
+    assistant_chats.pop(chat_id)
+    reset_chat(chat_id)
+    active_chats.pop(chat_id, None)
 
 @calls.on_closed_voice_chat()
 async def on_vc_closed_handler(client, chat_id: int):
     """Handle when voice chat is closed"""
-    logger.info(f"Voice chat closed in {chat_id}")
-    queues[chat_id].clear()
-    active_chats.discard(chat_id)
+    logger.info("Voice chat closed in %s", chat_id)
+    reset_chat(chat_id)
+    active_chats.pop(chat_id, None)
 
 # -------------------------
 # Helper Functions
 # -------------------------
+@lru_cache(maxsize=4096)
 def format_duration(seconds: int) -> str:
     """Format duration in HH:MM:SS or MM:SS"""
-    hours = seconds // 3600
-    minutes = (seconds % 3600) // 60
-    secs = seconds % 60
+    hours, rem = divmod(seconds, 3600)
+    minutes, secs = divmod(rem, 60)
     
     if hours > 0:
         return f"{hours:02d}:{minutes:02d}:{secs:02d}"
     return f"{minutes:02d}:{secs:02d}"
 
-def get_player_keyboard(chat_id: int) -> InlineKeyboardMarkup:
+def get_player_keyboard(chat_id: int, queue: Queue) -> InlineKeyboardMarkup:
     """Get player control keyboard"""
-    queue = queues[chat_id]
-    
-    pause_btn_text = "⏸ Pause" if (queue.is_playing and not queue.is_paused) else "▶️ Resume"
+    return _build_player_keyboard(
+        chat_id,
+        queue.is_playing and not queue.is_paused,
+        queue.loop_mode
+    )
+
+@lru_cache(maxsize=1024)
+def _build_player_keyboard(chat_id: int, playing: bool, loop_mode: LoopMode) -> InlineKeyboardMarkup:
+    """Build player keyboard, shared between calls with the same state"""
+    pause_btn_text = "⏸ Pause" if playing else "▶️ Resume"
     
     return InlineKeyboardMarkup([
         [
@@ -536,7 +861,7 @@ def get_player_keyboard(chat_id: int) -> InlineKeyboardMarkup:
             InlineKeyboardButton("⏹ Stop", callback_data=f"stop_{chat_id}")
         ],
         [
-            InlineKeyboardButton(f"🔁 {queue.loop_mode.name}", callback_data=f"loop_{chat_id}"),
+            InlineKeyboardButton(f"🔁 {loop_mode.name}", callback_data=f"loop_{chat_id}"),
             InlineKeyboardButton("🔀 Shuffle", callback_data=f"shuffle_{chat_id}"),
         ],
         [
@@ -545,28 +870,110 @@ def get_player_keyboard(chat_id: int) -> InlineKeyboardMarkup:
         ]
     ])
 
+def reset_chat(chat_id: int):
+    """Clear a chat's queue, dropping it unless it carries a loop mode"""
+    queue = queues.get(chat_id)
+    if not queue:
+        return
+    
+    queue.clear()
+    # Loop mode is a chat setting and outlives /stop and the end of the queue
+    if queue.loop_mode == LoopMode.DISABLED:
+        del queues[chat_id]
+
+def create_background_task(coro) -> asyncio.Task:
+    """Start a task that is kept referenced and cancelled on shutdown"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def schedule_panel_update(chat_id: int, message: Message):
+    """Refresh a player panel once rapid button presses settle"""
+    key = (chat_id, message.id)
+    if key not in pending_panels:
+        create_background_task(update_panel(key))
+    pending_panels[key] = message
+
+async def update_panel(key: Tuple[int, int]):
+    """Edit a panel's keyboard to the latest state, if it changed"""
+    await asyncio.sleep(Config.PANEL_EDIT_DELAY)
+    message = pending_panels.pop(key, None)
+    queue = queues.get(key[0])
+    if not message or not queue:
+        return
+    
+    keyboard = get_player_keyboard(key[0], queue)
+    if message.reply_markup == keyboard:
+        return
+    
+    try:
+        await message.edit_reply_markup(reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+    except Exception as e:
+        logger.error("Panel update error in %s: %s", key[0], e)
+
+def schedule_auto_leave(chat_id: int):
+    """Schedule an inactivity check for a chat"""
+    heapq.heappush(leave_deadlines, (time.monotonic() + Config.AUTO_LEAVE_TIME, chat_id))
+    leave_wakeup.set()
+
+async def safe_delete(message: Message):
+    """Delete a message, ignoring ones that are already gone or not deletable"""
+    try:
+        await message.delete()
+    except (MessageIdInvalid, MessageDeleteForbidden, MessageAuthorRequired):
+        pass
+    except RPCError as e:
+        # Cleanup only; a FloodWait or other API error here must not fail the caller
+        logger.warning("Failed to delete message: %s", e)
+
 async def is_admin(chat_id: int, user_id: int) -> bool:
     """Check if user is admin"""
     if user_id in Config.SUDO_USERS:
         return True
     
+    # Admin status rarely changes, so skip the API call for recent lookups
+    key = (chat_id, user_id)
+    cached = admin_cache.get(key)
+    if cached is not None:
+        return cached
+    
     try:
         member = await bot.get_chat_member(chat_id, user_id)
-        return member.status in [ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR]
+        result = member.status in [ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR]
+        admin_cache.set(key, result, ttl=None if result else Config.NON_ADMIN_CACHE_TTL)
+        return result
     except Exception as e:
-        logger.error(f"Admin check error: {e}")
+        logger.error("Admin check error: %s", e)
+        return False
+
+async def assistant_in_chat(chat_id: int) -> bool:
+    """Check, without joining, whether the assistant is in a chat"""
+    # Skip the membership round-trip for chats the assistant is known to be in
+    if chat_id in assistant_chats:
+        return True
+    
+    try:
+        await assistant.get_chat_member(chat_id, "me")
+    except UserNotParticipant:
         return False
+    
+    logger.info("Assistant already in chat %s", chat_id)
+    assistant_chats.set(chat_id, True)
+    return True
 
-async def join_chat_if_needed(chat_id: int):
-    """Make assistant join chat if not already in it"""
+async def join_chat_if_needed(chat_id: int, in_chat: Optional[bool] = None):
+    """Make assistant join chat if not already in it
+    
+    in_chat is a result of assistant_in_chat that the caller already has.
+    """
     try:
-        # Check if already a member
-        try:
-            await assistant.get_chat_member(chat_id, "me")
-            logger.info(f"Assistant already in chat {chat_id}")
+        if in_chat is None:
+            in_chat = await assistant_in_chat(chat_id)
+        if in_chat:
             return True
-        except UserNotParticipant:
-            pass
         
         # Try to join
         chat = await bot.get_chat(chat_id)
@@ -574,62 +981,67 @@ async def join_chat_if_needed(chat_id: int):
         if chat.username:
             # Public chat
             await assistant.join_chat(chat.username)
-            logger.info(f"Assistant joined public chat: {chat.username}")
+            logger.info("Assistant joined public chat: %s", chat.username)
         else:
             # Private chat - need invite link
             try:
                 invite_link = await bot.export_chat_invite_link(chat_id)
                 await assistant.join_chat(invite_link)
-                logger.info(f"Assistant joined via invite link")
+                logger.info("Assistant joined via invite link")
             except ChatAdminRequired:
                 raise Exception("❌ Bot must be admin to invite assistant!")
         
         await asyncio.sleep(2)
+        assistant_chats.set(chat_id, True)
         return True
         
     except Exception as e:
-        logger.error(f"Join chat error: {e}")
+        logger.error("Join chat error: %s", e)
         raise Exception(f"Failed to join chat: {str(e)}")
 
 # -------------------------
 # Bot Commands
 # -------------------------
+START_TEXT = (
+    "👋 **Hello! I'm {name}**\n\n"
+    "🎵 **Advanced Music Bot**\n\n"
+    "I can play music in your group voice chats with high quality!\n\n"
+    "**Commands:**\n"
+    "• `/play <song name or URL>` - Play a song\n"
+    "• `/pause` - Pause current song\n"
+    "• `/resume` - Resume playback\n"
+    "• `/skip` - Skip to next song\n"
+    "• `/stop` - Stop and clear queue\n"
+    "• `/queue` - View current queue\n"
+    "• `/loop` - Toggle loop mode\n"
+    "• `/shuffle` - Shuffle queue\n\n"
+    "**Add me to your group and start playing music!** 🎶"
+)
+
+@lru_cache(maxsize=1)
+def get_start_message(name: str, username: str) -> Tuple[str, InlineKeyboardMarkup]:
+    """Build the /start reply once per bot identity"""
+    keyboard = InlineKeyboardMarkup([[
+        InlineKeyboardButton(
+            "➕ Add to Group",
+            url=f"https://t.me/{username}?startgroup=true"
+        )
+    ]])
+    return START_TEXT.format(name=name), keyboard
+
 @bot.on_message(filters.command("start") & filters.private)
 async def start_command(client, message: Message):
     """Start command - private chats only"""
     try:
-        me = await bot.get_me()
-        
-        text = (
-            f"👋 **Hello! I'm {me.first_name}**\n\n"
-            "🎵 **Advanced Music Bot**\n\n"
-            "I can play music in your group voice chats with high quality!\n\n"
-            "**Commands:**\n"
-            "• `/play <song name or URL>` - Play a song\n"
-            "• `/pause` - Pause current song\n"
-            "• `/resume` - Resume playback\n"
-            "• `/skip` - Skip to next song\n"
-            "• `/stop` - Stop and clear queue\n"
-            "• `/queue` - View current queue\n"
-            "• `/loop` - Toggle loop mode\n"
-            "• `/shuffle` - Shuffle queue\n\n"
-            "**Add me to your group and start playing music!** 🎶"
-        )
-        
-        keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton(
-                "➕ Add to Group",
-                url=f"https://t.me/{me.username}?startgroup=true"
-            )
-        ]])
-        
+        # Filled in by bot.start(), so no get_me() round-trip per /start
+        me = bot.me or await bot.get_me()
+        text, keyboard = get_start_message(me.first_name, me.username)
         await message.reply_text(text, reply_markup=keyboard)
         
     except Exception as e:
-        logger.error(f"Start command error: {e}")
+        logger.error("Start command error: %s", e)
         await message.reply_text("❌ An error occurred!")
 
-@bot.on_message(filters.command("play") & filters.group)
 async def play_command(client, message: Message):
     """Play command"""
     chat_id = message.chat.id
@@ -646,13 +1058,22 @@ async def play_command(client, message: Message):
         query = message.text.split(None, 1)[1]
         status_msg = await message.reply_text("🔍 **Searching...**")
         
-        # Search YouTube
-        result = await YouTubeDownloader.search(query)
+        # Check membership alongside the search, but only join once the
+        # result is accepted so a failed /play doesn't pull the assistant in
+        result, in_chat = await asyncio.gather(
+            YouTubeDownloader.search(query),
+            assistant_in_chat(chat_id),
+            return_exceptions=True
+        )
         
-        if not result:
+        if not result or isinstance(result, Exception):
             await status_msg.edit("❌ **No results found!** Try a different query.")
             return
         
+        if result['is_live']:
+            await status_msg.edit("❌ **Live streams are not supported!**")
+            return
+        
         # Check duration
         if result['duration'] > Config.MAX_DURATION:
             await status_msg.edit(
@@ -662,9 +1083,9 @@ async def play_command(client, message: Message):
             )
             return
         
-        # Join chat if needed
         try:
-            await join_chat_if_needed(chat_id)
+            # A failed membership check is retried by the join itself
+            await join_chat_if_needed(chat_id, None if isinstance(in_chat, Exception) else in_chat)
         except Exception as e:
             await status_msg.edit(f"❌ {str(e)}")
             return
@@ -679,42 +1100,42 @@ async def play_command(client, message: Message):
             requester_id=message.from_user.id
         )
         
-        queue = queues[chat_id]
-        
-        # Check queue size
-        if len(queue.songs) >= Config.MAX_QUEUE_SIZE:
-            await status_msg.edit(
-                f"❌ **Queue is full!**\n\n"
-                f"Maximum: {Config.MAX_QUEUE_SIZE} songs"
-            )
-            return
-        
-        # Add to queue or play immediately
-        if queue.is_playing:
-            position = queue.add_song(song)
-            await status_msg.edit(
-                f"✅ **Added to queue at position #{position}**\n\n"
-                f"**{song.title}**\n"
-                f"⏱ Duration: `{format_duration(song.duration)}`\n"
-                f"👤 Requested by: {song.requester}"
-            )
-        else:
-            queue.songs.insert(0, song)
-            await status_msg.edit("⏳ **Loading song...**")
+        async with chat_locks[chat_id]:
+            queue = queues.setdefault(chat_id, Queue())
             
-            await process_next_song(chat_id)
+            # Check queue size
+            if len(queue.songs) >= Config.MAX_QUEUE_SIZE:
+                await status_msg.edit(
+                    f"❌ **Queue is full!**\n\n"
+                    f"Maximum: {Config.MAX_QUEUE_SIZE} songs"
+                )
+                return
             
-            try:
-                await status_msg.delete()
-            except:
-                pass
+            # Add to queue or play immediately
+            if queue.is_playing:
+                position = queue.add_song(song)
+                await status_msg.edit(
+                    f"✅ **Added to queue at position #{position}**\n\n"
+                    f"**{song.title}**\n"
+                    f"⏱ Duration: `{format_duration(song.duration)}`\n"
+                    f"👤 Requested by: {song.requester}"
+                )
+                return
+            
+            # Taken in the same lock as the decision to play, so a skip or a
+            # concurrent /play can't start this song or jump past it
+            queue.is_playing = True
+            queue.generation += 1
+            picked = (queue, song, queue.generation)
+        
+        await status_msg.edit("⏳ **Loading song...**")
+        await process_next_song(chat_id, picked)
+        await safe_delete(status_msg)
         
     except Exception as e:
-        logger.error(f"Play command error: {e}")
-        traceback.print_exc()
+        logger.exception("Play command error: %s", e)
         await message.reply_text(f"❌ **Error:** {str(e)}")
 
-@bot.on_message(filters.command("pause") & filters.group)
 async def pause_command(client, message: Message):
     """Pause command"""
     try:
@@ -722,9 +1143,9 @@ async def pause_command(client, message: Message):
             await message.reply_text("❌ **Only admins can use this command!**")
             return
         
-        queue = queues[message.chat.id]
+        queue = queues.get(message.chat.id)
         
-        if not queue.is_playing:
+        if not queue or not queue.is_playing:
             await message.reply_text("❌ **Nothing is playing!**")
             return
         
@@ -738,10 +1159,9 @@ async def pause_command(client, message: Message):
         await message.reply_text("⏸ **Paused!**")
         
     except Exception as e:
-        logger.error(f"Pause error: {e}")
+        logger.error("Pause error: %s", e)
         await message.reply_text(f"❌ **Error:** {str(e)}")
 
-@bot.on_message(filters.command("resume") & filters.group)
 async def resume_command(client, message: Message):
     """Resume command"""
     try:
@@ -749,9 +1169,9 @@ async def resume_command(client, message: Message):
             await message.reply_text("❌ **Only admins can use this command!**")
             return
         
-        queue = queues[message.chat.id]
+        queue = queues.get(message.chat.id)
         
-        if not queue.is_paused:
+        if not queue or not queue.is_paused:
             await message.reply_text("▶️ **Not paused!**")
             return
         
@@ -761,10 +1181,9 @@ async def resume_command(client, message: Message):
         await message.reply_text("▶️ **Resumed!**")
         
     except Exception as e:
-        logger.error(f"Resume error: {e}")
+        logger.error("Resume error: %s", e)
         await message.reply_text(f"❌ **Error:** {str(e)}")
 
-@bot.on_message(filters.command("skip") & filters.group)
 async def skip_command(client, message: Message):
     """Skip command"""
     try:
@@ -772,9 +1191,9 @@ async def skip_command(client, message: Message):
             await message.reply_text("❌ **Only admins can use this command!**")
             return
         
-        queue = queues[message.chat.id]
+        queue = queues.get(message.chat.id)
         
-        if not queue.is_playing:
+        if not queue or not queue.is_playing:
             await message.reply_text("❌ **Nothing is playing!**")
             return
         
@@ -782,10 +1201,9 @@ async def skip_command(client, message: Message):
         await process_next_song(message.chat.id)
         
     except Exception as e:
-        logger.error(f"Skip error: {e}")
+        logger.error("Skip error: %s", e)
         await message.reply_text(f"❌ **Error:** {str(e)}")
 
-@bot.on_message(filters.command("stop") & filters.group)
 async def stop_command(client, message: Message):
     """Stop command"""
     try:
@@ -793,62 +1211,63 @@ async def stop_command(client, message: Message):
             await message.reply_text("❌ **Only admins can use this command!**")
             return
         
-        queue = queues[message.chat.id]
+        queue = queues.get(message.chat.id)
         
-        if not queue.is_playing:
+        # A queue restored after a restart has songs but isn't playing yet
+        if not queue or not (queue.is_playing or queue.songs):
             await message.reply_text("❌ **Nothing is playing!**")
             return
         
-        await MusicPlayer.stop(message.chat.id)
-        queue.clear()
+        # Under the lock so a song that is starting can't outlive the stop
+        async with chat_locks[message.chat.id]:
+            await MusicPlayer.stop(message.chat.id)
+            reset_chat(message.chat.id)
         
         await message.reply_text("⏹ **Stopped and cleared queue!**")
         
     except Exception as e:
-        logger.error(f"Stop error: {e}")
+        logger.error("Stop error: %s", e)
         await message.reply_text(f"❌ **Error:** {str(e)}")
 
-@bot.on_message(filters.command("queue") & filters.group)
 async def queue_command(client, message: Message):
     """Queue command"""
     try:
-        queue = queues[message.chat.id]
+        queue = queues.get(message.chat.id)
         
-        if not queue.current and not queue.songs:
+        if not queue or (not queue.current and not queue.songs):
             await message.reply_text("📭 **Queue is empty!**")
             return
         
-        text = ""
+        parts = []
         
         if queue.current:
-            text += (
+            parts.append(
                 f"🎵 **Now Playing:**\n"
                 f"**{queue.current.title}**\n"
                 f"⏱ `{format_duration(queue.current.duration)}`\n\n"
             )
         
         if queue.songs:
-            text += "📋 **Queue:**\n\n"
+            parts.append("📋 **Queue:**\n\n")
             
-            for i, song in enumerate(queue.songs[:10], 1):
-                text += (
-                    f"`{i}.` **{song.title}**\n"
-                    f"   ⏱ `{format_duration(song.duration)}` | 👤 {song.requester}\n\n"
-                )
+            parts.extend(
+                f"`{i}.` **{song.title}**\n"
+                f"   ⏱ `{format_duration(song.duration)}` | 👤 {song.requester}\n\n"
+                for i, song in enumerate(islice(queue.songs, 10), 1)
+            )
             
             if len(queue.songs) > 10:
-                text += f"\n*...and {len(queue.songs) - 10} more songs*"
+                parts.append(f"\n*...and {len(queue.songs) - 10} more songs*")
             
             total_duration = sum(s.duration for s in queue.songs)
-            text += f"\n\n⏱ **Total Queue Duration:** `{format_duration(total_duration)}`"
+            parts.append(f"\n\n⏱ **Total Queue Duration:** `{format_duration(total_duration)}`")
         
-        await message.reply_text(text)
+        await message.reply_text("".join(parts))
         
     except Exception as e:
-        logger.error(f"Queue error: {e}")
+        logger.error("Queue error: %s", e)
         await message.reply_text(f"❌ **Error:** {str(e)}")
 
-@bot.on_message(filters.command("loop") & filters.group)
 async def loop_command(client, message: Message):
     """Loop command"""
     try:
@@ -856,7 +1275,7 @@ async def loop_command(client, message: Message):
             await message.reply_text("❌ **Only admins can use this command!**")
             return
         
-        queue = queues[message.chat.id]
+        queue = queues.setdefault(message.chat.id, Queue())
         
         # Cycle through loop modes
         if queue.loop_mode == LoopMode.DISABLED:
@@ -872,10 +1291,9 @@ async def loop_command(client, message: Message):
         await message.reply_text(text)
         
     except Exception as e:
-        logger.error(f"Loop error: {e}")
+        logger.error("Loop error: %s", e)
         await message.reply_text(f"❌ **Error:** {str(e)}")
 
-@bot.on_message(filters.command("shuffle") & filters.group)
 async def shuffle_command(client, message: Message):
     """Shuffle command"""
     try:
@@ -883,9 +1301,9 @@ async def shuffle_command(client, message: Message):
             await message.reply_text("❌ **Only admins can use this command!**")
             return
         
-        queue = queues[message.chat.id]
+        queue = queues.get(message.chat.id)
         
-        if not queue.songs:
+        if not queue or not queue.songs:
             await message.reply_text("❌ **Queue is empty!**")
             return
         
@@ -893,9 +1311,26 @@ async def shuffle_command(client, message: Message):
         await message.reply_text("🔀 **Queue shuffled!**")
         
     except Exception as e:
-        logger.error(f"Shuffle error: {e}")
+        logger.error("Shuffle error: %s", e)
         await message.reply_text(f"❌ **Error:** {str(e)}")
 
+# All group commands share one handler so each message is matched once
+GROUP_COMMANDS = {
+    "play": play_command,
+    "pause": pause_command,
+    "resume": resume_command,
+    "skip": skip_command,
+    "stop": stop_command,
+    "queue": queue_command,
+    "loop": loop_command,
+    "shuffle": shuffle_command,
+}
+
+@bot.on_message(filters.command(list(GROUP_COMMANDS)) & filters.group)
+async def group_command_handler(client, message: Message):
+    """Dispatch group commands"""
+    await GROUP_COMMANDS[message.command[0].lower()](client, message)
+
 @bot.on_message(filters.command("ping"))
 async def ping_command(client, message: Message):
     """Ping command"""
@@ -910,17 +1345,17 @@ async def ping_command(client, message: Message):
         )
         
     except Exception as e:
-        logger.error(f"Ping error: {e}")
+        logger.error("Ping error: %s", e)
 
 @bot.on_message(filters.command("stats"))
 async def stats_command(client, message: Message):
     """Stats command"""
     try:
-        uptime = datetime.now() - START_TIME
+        uptime = timedelta(seconds=int(time.monotonic() - START_TIME))
         
         text = (
             f"📊 **Bot Statistics**\n\n"
-            f"⏰ **Uptime:** `{str(uptime).split('.')[0]}`\n"
+            f"⏰ **Uptime:** `{uptime}`\n"
             f"🎵 **Active Chats:** `{len(active_chats)}`\n"
             f"📋 **Total Queued:** `{sum(len(q.songs) for q in queues.values())} songs`\n"
             f"💾 **Cached Files:** `{len(download_cache)}`\n"
@@ -929,34 +1364,120 @@ async def stats_command(client, message: Message):
         await message.reply_text(text)
         
     except Exception as e:
-        logger.error(f"Stats error: {e}")
+        logger.error("Stats error: %s", e)
         await message.reply_text(f"❌ **Error:** {str(e)}")
 
+@bot.on_chat_member_updated(filters.group)
+async def chat_member_updated_handler(client, update: ChatMemberUpdated):
+    """Forget cached admin status when a member is promoted or demoted"""
+    member = update.new_chat_member or update.old_chat_member
+    if member and member.user:
+        admin_cache.pop((update.chat.id, member.user.id))
+
 # -------------------------
 # Callback Query Handler
 # -------------------------
-@bot.on_callback_query()
+CALLBACK_PATTERN = re.compile(r"^(pause|skip|stop|loop|shuffle|queue|close)_(-?\d+)$")
+
+async def pause_callback(callback_query: CallbackQuery, chat_id: int, queue: Queue) -> bool:
+    """Toggle pause, returning whether the keyboard needs refreshing"""
+    if queue.is_paused:
+        await MusicPlayer.resume(chat_id)
+        queue.is_paused = False
+        await callback_query.answer("▶️ Resumed")
+    else:
+        await MusicPlayer.pause(chat_id)
+        queue.is_paused = True
+        await callback_query.answer("⏸ Paused")
+    return True
+
+async def skip_callback(callback_query: CallbackQuery, chat_id: int, queue: Queue) -> bool:
+    """Skip to the next song"""
+    await callback_query.answer("⏭ Skipped")
+    create_background_task(process_next_song(chat_id))
+    return True
+
+async def stop_callback(callback_query: CallbackQuery, chat_id: int, queue: Queue) -> bool:
+    """Stop playback and remove the panel"""
+    await MusicPlayer.stop(chat_id)
+    reset_chat(chat_id)
+    await asyncio.gather(
+        callback_query.answer("⏹ Stopped"),
+        safe_delete(callback_query.message),
+        return_exceptions=True
+    )
+    return False
+
+async def loop_callback(callback_query: CallbackQuery, chat_id: int, queue: Queue) -> bool:
+    """Cycle the loop mode"""
+    if queue.loop_mode == LoopMode.DISABLED:
+        queue.loop_mode = LoopMode.SINGLE
+        text = "Single"
+    elif queue.loop_mode == LoopMode.SINGLE:
+        queue.loop_mode = LoopMode.QUEUE
+        text = "Queue"
+    else:
+        queue.loop_mode = LoopMode.DISABLED
+        text = "Off"
+    await callback_query.answer(f"🔁 Loop: {text}")
+    return True
+
+async def shuffle_callback(callback_query: CallbackQuery, chat_id: int, queue: Queue) -> bool:
+    """Shuffle the queue"""
+    if not queue.songs:
+        await callback_query.answer("❌ Queue is empty!", show_alert=True)
+        return False
+    
+    queue.shuffle()
+    await callback_query.answer("🔀 Shuffled")
+    return True
+
+async def queue_callback(callback_query: CallbackQuery, chat_id: int, queue: Queue) -> bool:
+    """Reply with a short queue listing"""
+    parts = []
+    if queue.current:
+        parts.append(f"🎵 **Now:** {queue.current.title}\n\n")
+    
+    if queue.songs:
+        parts.append("📋 **Queue:**\n")
+        parts.extend(
+            f"`{i}.` {song.title}\n"
+            for i, song in enumerate(islice(queue.songs, 5), 1)
+        )
+        if len(queue.songs) > 5:
+            parts.append(f"\n*...and {len(queue.songs) - 5} more*")
+    else:
+        parts.append("📭 Queue is empty")
+    
+    await callback_query.answer()
+    await callback_query.message.reply_text("".join(parts))
+    return False
+
+CALLBACK_ACTIONS = {
+    "pause": pause_callback,
+    "skip": skip_callback,
+    "stop": stop_callback,
+    "loop": loop_callback,
+    "shuffle": shuffle_callback,
+    "queue": queue_callback,
+}
+
+# Only player buttons reach this handler; other callbacks are filtered out by pyrogram
+@bot.on_callback_query(filters.regex(CALLBACK_PATTERN))
 async def callback_handler(client, callback_query: CallbackQuery):
     """Handle callback queries from inline buttons"""
     try:
-        data = callback_query.data
+        # filters.regex already matched the data and stored the match
+        match = callback_query.matches[0]
+        action, chat_id = match.group(1), int(match.group(2))
         
         # Close button
-        if data.startswith("close_"):
-            try:
-                await callback_query.message.delete()
-            except:
-                pass
+        if action == "close":
+            await safe_delete(callback_query.message)
             await callback_query.answer()
             return
         
-        # Parse action and chat_id
-        try:
-            action, chat_id_str = data.rsplit("_", 1)
-            chat_id = int(chat_id_str)
-        except ValueError:
-            await callback_query.answer("❌ Invalid callback data!", show_alert=True)
-            return
+        handler = CALLBACK_ACTIONS[action]
         
         # Check admin permissions (except for queue view)
         if action != "queue":
@@ -964,157 +1485,293 @@ async def callback_handler(client, callback_query: CallbackQuery):
                 await callback_query.answer("❌ Only admins can use this!", show_alert=True)
                 return
         
-        queue = queues[chat_id]
-        
-        # Handle actions
-        if action == "pause":
-            if queue.is_paused:
-                await MusicPlayer.resume(chat_id)
-                queue.is_paused = False
-                await callback_query.answer("▶️ Resumed")
-            else:
-                await MusicPlayer.pause(chat_id)
-                queue.is_paused = True
-                await callback_query.answer("⏸ Paused")
-        
-        elif action == "skip":
-            await callback_query.answer("⏭ Skipped")
-            await process_next_song(chat_id)
-        
-        elif action == "stop":
-            await MusicPlayer.stop(chat_id)
-            queue.clear()
-            await callback_query.answer("⏹ Stopped")
-            try:
-                await callback_query.message.delete()
-            except:
-                pass
+        queue = queues.get(chat_id)
+        if queue is None:
+            await callback_query.answer("❌ Nothing is playing!", show_alert=True)
             return
         
-        elif action == "loop":
-            if queue.loop_mode == LoopMode.DISABLED:
-                queue.loop_mode = LoopMode.SINGLE
-                text = "Single"
-            elif queue.loop_mode == LoopMode.SINGLE:
-                queue.loop_mode = LoopMode.QUEUE
-                text = "Queue"
-            else:
-                queue.loop_mode = LoopMode.DISABLED
-                text = "Off"
-            await callback_query.answer(f"🔁 Loop: {text}")
-        
-        elif action == "shuffle":
-            if queue.songs:
-                queue.shuffle()
-                await callback_query.answer("🔀 Shuffled")
-            else:
-                await callback_query.answer("❌ Queue is empty!", show_alert=True)
-                return
-        
-        elif action == "queue":
-            text = ""
-            if queue.current:
-                text += f"🎵 **Now:** {queue.current.title}\n\n"
+        # Serialise button actions per chat; other chats are not blocked
+        async with chat_locks[chat_id]:
+            if await handler(callback_query, chat_id, queue):
+                schedule_panel_update(chat_id, callback_query.message)
             
-            if queue.songs:
-                text += "📋 **Queue:**\n"
-                for i, song in enumerate(queue.songs[:5], 1):
-                    text += f"`{i}.` {song.title}\n"
-                if len(queue.songs) > 5:
-                    text += f"\n*...and {len(queue.songs) - 5} more*"
-            else:
-                text += "📭 Queue is empty"
-            
-            await callback_query.answer()
-            await callback_query.message.reply_text(text)
-            return
-        
-        # Update keyboard
-        try:
-            await callback_query.message.edit_reply_markup(
-                reply_markup=get_player_keyboard(chat_id)
-            )
-        except:
-            pass
-        
     except Exception as e:
-        logger.error(f"Callback handler error: {e}")
-        traceback.print_exc()
+        logger.exception("Callback handler error: %s", e)
         await callback_query.answer(f"❌ Error: {str(e)}", show_alert=True)
 
 # -------------------------
 # Background Tasks
 # -------------------------
+def prune_idle_chats() -> int:
+    """Drop empty queues left behind by idle chats"""
+    idle_queues = [
+        chat_id for chat_id, queue in queues.items()
+        if chat_id not in active_chats
+        and not queue.is_playing
+        and not queue.current
+        and not queue.songs
+        and queue.loop_mode == LoopMode.DISABLED
+    ]
+    for chat_id in idle_queues:
+        del queues[chat_id]
+    
+    # Chat locks are kept: they are tiny, and replacing one that a coroutine
+    # is about to acquire would let two holders into the same chat
+    return len(idle_queues)
+
+def queued_video_ids() -> set:
+    """Video ids that are playing or waiting in any queue"""
+    video_ids = set()
+    for queue in queues.values():
+        if queue.current:
+            video_ids.add(queue.current.video_id)
+        video_ids.update(song.video_id for song in queue.songs)
+    return video_ids
+
+def cleanup_old_files(keep: set) -> List[str]:
+    """Evict downloaded files least recently used first, returning their video ids"""
+    current_time = time.time()
+    total_size = 0
+    files = []
+    
+    # scandir entries carry their stat info, avoiding extra syscalls per file
+    with os.scandir(Config.DOWNLOAD_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat()
+            total_size += stat.st_size
+            files.append((stat.st_mtime, stat.st_size, entry))
+    
+    # Cache hits refresh mtime, so oldest mtime first is LRU order
+    files.sort(key=lambda f: f[0])
+    removed = []
+    
+    for mtime, size, entry in files:
+        expired = current_time - mtime > Config.DOWNLOAD_MAX_AGE
+        if not expired and total_size <= Config.DOWNLOAD_CACHE_BYTES:
+            break
+        
+        video_id = entry.name.split(".", 1)[0]
+        if video_id in keep:
+            continue
+        
+        try:
+            os.remove(entry.path)
+            total_size -= size
+            removed.append(video_id)
+            logger.info("Cleaned old file: %s", entry.name)
+        except Exception as e:
+            logger.error("Failed to delete %s: %s", entry.name, e)
+    
+    return removed
+
 async def auto_cleanup_files():
     """Automatically cleanup old downloaded files"""
     while True:
         try:
-            await asyncio.sleep(1800)  # Every 30 minutes
+            # Woken when a song finishes; the timeout is only a fallback sweep
+            cleanup_wakeup.clear()
+            try:
+                await asyncio.wait_for(cleanup_wakeup.wait(), Config.CLEANUP_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
             
-            current_time = time.time()
-            cleaned_count = 0
+            # Scan off the event loop so playback handlers aren't stalled
+            loop = asyncio.get_event_loop()
+            removed = await loop.run_in_executor(None, cleanup_old_files, queued_video_ids())
             
-            for filename in os.listdir(Config.DOWNLOAD_DIR):
-                file_path = os.path.join(Config.DOWNLOAD_DIR, filename)
-                
-                if not os.path.isfile(file_path):
-                    continue
-                
-                # Check file age
-                file_age = current_time - os.path.getmtime(file_path)
+            for video_id in removed:
+                download_cache.pop(video_id)
+            
+            if removed:
+                logger.info("Cleaned %s files", len(removed))
+            
+            pruned = prune_idle_chats()
+            if pruned:
+                logger.info("Pruned state for %s idle chats", pruned)
                 
-                # Remove if older than 1 hour and not in cache
-                video_id = os.path.splitext(filename)[0]
-                if file_age > 3600 and video_id not in download_cache:
-                    try:
-                        os.remove(file_path)
-                        cleaned_count += 1
-                        logger.info(f"Cleaned old file: {filename}")
-                    except Exception as e:
-                        logger.error(f"Failed to delete {filename}: {e}")
+        except Exception as e:
+            logger.exception("Auto cleanup error: %s", e)
+
+async def warm_assistant_peers():
+    """Load the assistant's dialogs once so first joins skip peer lookups"""
+    try:
+        count = 0
+        async for dialog in assistant.get_dialogs(limit=Config.PEER_WARMUP_LIMIT):
+            # Groups listed here are ones the assistant is already a member of
+            if dialog.chat.type in (ChatType.GROUP, ChatType.SUPERGROUP):
+                assistant_chats.set(dialog.chat.id, True)
+            count += 1
+        
+        logger.info("Warmed %s assistant dialogs", count)
+        
+    except Exception as e:
+        logger.error("Peer warmup error: %s", e)
+
+def snapshot_queues() -> str:
+    """Serialize every non-empty queue, current song first"""
+    state = {}
+    for chat_id, queue in queues.items():
+        songs = ([queue.current] if queue.current else []) + list(queue.songs)
+        if not songs:
+            continue
+        state[str(chat_id)] = {
+            'loop_mode': queue.loop_mode.value,
+            'songs': [
+                {
+                    'title': song.title,
+                    'url': song.url,
+                    'duration': song.duration,
+                    'video_id': song.video_id,
+                    'requester': song.requester,
+                    'requester_id': song.requester_id,
+                }
+                for song in songs
+            ],
+        }
+    return json.dumps(state, ensure_ascii=False)
+
+def write_state(data: str):
+    """Atomically replace the saved queue state"""
+    tmp_path = f"{Config.STATE_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(data)
+    os.replace(tmp_path, Config.STATE_FILE)
+
+def load_queues() -> List[int]:
+    """Restore queues saved by a previous run, returning the chats loaded"""
+    try:
+        with open(Config.STATE_FILE, encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        logger.error("Failed to load saved queues: %s", e)
+        return []
+    
+    if not isinstance(state, dict):
+        logger.error("Ignoring saved queues: unexpected format")
+        return []
+    
+    loaded = []
+    for chat_id, data in state.items():
+        # One stale or hand-edited entry shouldn't keep the bot from starting
+        try:
+            queue = Queue()
+            queue.loop_mode = LoopMode(data['loop_mode'])
+            queue.songs.extend(Song(**song) for song in data['songs'])
+            queues[int(chat_id)] = queue
+            loaded.append(int(chat_id))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Skipping saved queue for %s: %r", chat_id, e)
+    
+    return loaded
+
+async def expire_restored_queues(chat_ids: List[int]):
+    """Drop restored queues that nobody resumed within the TTL"""
+    restored = {chat_id: queues.get(chat_id) for chat_id in chat_ids}
+    await asyncio.sleep(Config.RESTORED_QUEUE_TTL)
+    
+    expired = 0
+    for chat_id, queue in restored.items():
+        async with chat_locks[chat_id]:
+            # Resumed, stopped or replaced since the restart
+            if queues.get(chat_id) is not queue or queue.is_playing or chat_id in active_chats:
+                continue
+            reset_chat(chat_id)
+            expired += 1
+    
+    if expired:
+        logger.info("Dropped %s restored queues that were never resumed", expired)
+
+async def auto_save_queues():
+    """Periodically save queues so they survive a restart"""
+    last_saved = None
+    while True:
+        try:
+            await asyncio.sleep(Config.STATE_SAVE_INTERVAL)
             
-            if cleaned_count > 0:
-                logger.info(f"Cleaned {cleaned_count} files")
+            data = snapshot_queues()
+            if data != last_saved:
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, write_state, data)
+                last_saved = data
                 
         except Exception as e:
-            logger.error(f"Auto cleanup error: {e}")
-            traceback.print_exc()
+            logger.exception("Auto save error: %s", e)
 
 async def auto_leave_inactive():
     """Leave voice chats after inactivity"""
     while True:
         try:
-            await asyncio.sleep(60)  # Check every minute
+            # Sleep until the earliest deadline, or until a new one is scheduled
+            leave_wakeup.clear()
+            if not leave_deadlines or leave_deadlines[0][0] > time.monotonic():
+                timeout = leave_deadlines[0][0] - time.monotonic() if leave_deadlines else None
+                try:
+                    await asyncio.wait_for(leave_wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
             
-            current_time = datetime.now()
+            now = time.monotonic()
             
-            for chat_id in list(active_chats):
-                queue = queues[chat_id]
+            while leave_deadlines and leave_deadlines[0][0] <= now:
+                _, chat_id = heapq.heappop(leave_deadlines)
+                last_active = active_chats.get(chat_id)
                 
-                # Check if not playing and queue is empty
-                if not queue.is_playing and not queue.songs:
-                    # Leave after AUTO_LEAVE_TIME seconds
-                    try:
-                        await MusicPlayer.stop(chat_id)
-                        queue.clear()
-                        
-                        await bot.send_message(
-                            chat_id,
-                            "👋 **Left voice chat due to inactivity**"
-                        )
-                        logger.info(f"Auto-left chat {chat_id}")
-                    except Exception as e:
-                        logger.error(f"Auto leave error for {chat_id}: {e}")
+                # Stale entry: already left, or a newer deadline exists
+                if last_active is None or now - last_active < Config.AUTO_LEAVE_TIME:
+                    if last_active is None:
+                        leave_retries.pop(chat_id, None)
+                    continue
+                
+                queue = queues.get(chat_id)
+                
+                # Still playing, check again later
+                if queue and (queue.is_playing or queue.songs):
+                    heapq.heappush(leave_deadlines, (now + Config.AUTO_LEAVE_TIME, chat_id))
+                    continue
+                
+                try:
+                    await MusicPlayer.stop(chat_id)
+                    
+                    # stop() only logs failures; retry a few times, then assume
+                    # the call is already gone (e.g. not in it) and forget the chat
+                    if chat_id in active_chats:
+                        retries = leave_retries.get(chat_id, 0) + 1
+                        if retries < Config.MAX_LEAVE_RETRIES:
+                            leave_retries[chat_id] = retries
+                            heapq.heappush(leave_deadlines, (now + Config.AUTO_LEAVE_TIME, chat_id))
+                            continue
                         
+                        logger.warning("Giving up leaving %s after %d attempts", chat_id, retries)
+                        active_chats.pop(chat_id, None)
+                    
+                    leave_retries.pop(chat_id, None)
+                    reset_chat(chat_id)
+                    
+                    await bot.send_message(
+                        chat_id,
+                        "👋 **Left voice chat due to inactivity**",
+                        disable_notification=True
+                    )
+                    logger.info("Auto-left chat %s", chat_id)
+                except Exception as e:
+                    logger.error("Auto leave error for %s: %s", chat_id, e)
+                    
         except Exception as e:
-            logger.error(f"Auto leave task error: {e}")
-            traceback.print_exc()
+            logger.exception("Auto leave task error: %s", e)
 
 # -------------------------
 # Main Function
 # -------------------------
 async def main():
     """Main function to start the bot"""
+    # Saving before the load would overwrite the file with empty queues
+    state_loaded = False
+    
     try:
         logger.info("=" * 50)
         logger.info("Starting Advanced Music Bot...")
@@ -1124,13 +1781,13 @@ async def main():
         logger.info("Starting bot client...")
         await bot.start()
         bot_info = await bot.get_me()
-        logger.info(f"✅ Bot started: @{bot_info.username}")
+        logger.info("✅ Bot started: @%s", bot_info.username)
         
         # Start assistant client
         logger.info("Starting assistant client...")
         await assistant.start()
         assistant_info = await assistant.get_me()
-        logger.info(f"✅ Assistant started: @{assistant_info.username}")
+        logger.info("✅ Assistant started: @%s", assistant_info.username)
         
         # Start PyTgCalls
         logger.info("Starting PyTgCalls...")
@@ -1149,12 +1806,21 @@ async def main():
                 )
                 logger.info("Sent startup notification to log channel")
             except Exception as e:
-                logger.error(f"Failed to send startup notification: {e}")
+                logger.error("Failed to send startup notification: %s", e)
+        
+        # Queues come back paused; the next /play in a chat picks them up
+        restored = load_queues()
+        state_loaded = True
+        if restored:
+            logger.info("Restored %s saved queues", len(restored))
+            create_background_task(expire_restored_queues(restored))
         
         # Start background tasks
         logger.info("Starting background tasks...")
-        asyncio.create_task(auto_cleanup_files())
-        asyncio.create_task(auto_leave_inactive())
+        create_background_task(auto_cleanup_files())
+        create_background_task(auto_leave_inactive())
+        create_background_task(auto_save_queues())
+        create_background_task(warm_assistant_peers())
         logger.info("✅ Background tasks started")
         
         logger.info("=" * 50)
@@ -1165,13 +1831,24 @@ async def main():
         await idle()
         
     except Exception as e:
-        logger.critical(f"Fatal error in main: {e}")
-        traceback.print_exc()
+        logger.critical("Fatal error in main: %s", e, exc_info=True)
         raise
     
     finally:
         logger.info("Shutting down...")
         
+        # Cancel background work before the clients it uses go away
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        
+        if state_loaded:
+            try:
+                write_state(snapshot_queues())
+                logger.info("✅ Queues saved")
+            except Exception as e:
+                logger.error("Failed to save queues: %s", e)
+        
         try:
             await calls.stop()
             logger.info("✅ PyTgCalls stopped")
@@ -1190,6 +1867,7 @@ async def main():
         except:
             pass
         
+        ytdl_executor.shutdown(wait=False, cancel_futures=True)
         logger.info("Shutdown complete")
 
 # -------------------------
@@ -1209,8 +1887,7 @@ if __name__ == "__main__":
         logger.info("Bot stopped by user (Ctrl+C)")
     
     except Exception as e:
-        logger.critical(f"Fatal error: {e}")
-        traceback.print_exc()
+        logger.critical("Fatal error: %s", e, exc_info=True)
         sys.exit(1)
     
     finally: